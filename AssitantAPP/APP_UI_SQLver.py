@@ -9,14 +9,15 @@ Author: ChatGPT (auto‑generated)
 ▶ 功能
 -------
 1. 讓使用者輸入 **產品關鍵字** ➜ 呼叫 `IndexSQL.search_products()`。
-2. 等待 `IndexSQL` 產生 *IndexSQL_find.csv* 後，接著呼叫
-   `HistoryDataSearch.HistoryDataSearch()` 產生點數變更 DataFrame。
+2. 將 `IndexSQL` 回傳的搜尋結果 DataFrame 直接交給
+   `HistoryDataSearch.HistoryDataSearch()` 產生點數變更 DataFrame；
+   價量調查檔等來源 CSV 則在 IndexSQL 搜尋期間於背景先行讀取。
 3. 將結果以 `QTableView` 顯示，並在下方狀態列回報成功 / 失敗。
 
 📦 依賴
 -------
 ```
-pip install PyQt5 pandas fuzzywuzzy python-Levenshtein
+pip install PyQt5 pandas pyarrow rapidfuzz
 ```
 
 📁 建議目錄
@@ -32,15 +33,17 @@ project/
 └─ integrated_ui.py              ← 本檔
 ```
 
-> *執行時會請你選擇 `data/` 目錄，以便讀寫 CSV 與 DB 檔。*
+> *執行時會請你選擇 `data/` 目錄，以便讀寫 CSV 檔。*
 
 """
 import sys
 import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 import pandas as pd
-from PyQt5.QtCore import Qt, QAbstractTableModel, QVariant, pyqtSignal, QObject, QThread
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QVariant, pyqtSignal, QObject, QThread
 from PyQt5.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -63,26 +66,76 @@ import HistoryDataSearch
 # QAbstractTableModel – 把 Pandas DataFrame 掛到 QTableView
 ###############################################################################
 class PandasModel(QAbstractTableModel):
+    """
+    分段載入的 DataFrame 模型：
+    • 一開始只回報 FETCH_CHUNK 列，捲動到底時由 canFetchMore()/fetchMore() 再補列
+    • 儲存格字串於 data() 被要求時才轉換，並以 LRU 快取（上限 STR_CACHE_SIZE 格）
+    • 換資料請呼叫 setDataFrame()，沿用同一個模型
+    """
+    FETCH_CHUNK = 200
+    STR_CACHE_SIZE = 20000
+
     def __init__(self, df: pd.DataFrame):
         super().__init__()
-        self._df = df
-
-    def rowCount(self, parent=None):
-        return len(self._df)
+        self._str_cache = OrderedDict()
+        self._load(df)
 
-    def columnCount(self, parent=None):
-        return len(self._df.columns)
+    def _load(self, df: pd.DataFrame):
+        self._df = df
+        # data() 每次重繪都會被逐格呼叫：改用 ndarray 直接取值（避開 iloc）
+        self._values = df.to_numpy(dtype=object)
+        self._cols = df.columns.tolist()
+        self._loaded_rows = min(len(self._values), self.FETCH_CHUNK)
+        self._str_cache.clear()
+
+    def setDataFrame(self, df: pd.DataFrame):
+        self.beginResetModel()
+        self._load(df)
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._loaded_rows
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._cols)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return self._loaded_rows < len(self._values)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        count = min(self.FETCH_CHUNK, len(self._values) - self._loaded_rows)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded_rows, self._loaded_rows + count - 1)
+        self._loaded_rows += count
+        self.endInsertRows()
 
     def data(self, index, role=Qt.DisplayRole):
         if role == Qt.DisplayRole:
-            value = self._df.iloc[index.row(), index.column()]
-            return str(value)
+            key = (index.row(), index.column())
+            text = self._str_cache.get(key)
+            if text is None:
+                text = str(self._values[key])
+                self._str_cache[key] = text
+                if len(self._str_cache) > self.STR_CACHE_SIZE:
+                    self._str_cache.popitem(last=False)
+            else:
+                self._str_cache.move_to_end(key)
+            return text
         return QVariant()
 
     def headerData(self, section, orientation, role=Qt.DisplayRole):
         if role == Qt.DisplayRole:
             if orientation == Qt.Horizontal:
-                return str(self._df.columns[section])
+                return str(self._cols[section])
             else:
                 return str(section)
         return QVariant()
@@ -101,22 +154,49 @@ class Worker(QObject):
     def run(self):
         try:
             data_dir = os.path.join(self.base_dir, "data")
-            # 1️⃣ 執行 IndexSQL 搜尋
-            csv_indexcode = os.path.join(data_dir, "IndexCode.csv")
-            db_file = os.path.join(data_dir, "products.db")
-            IndexSQL.search_products(
-                self.keyword,
-                db_file=db_file,
-                csv_file=csv_indexcode,
-            )
-
-            # 2️⃣ 執行 HistoryDataSearch
+            format_file = os.path.join(data_dir, "format_clean.csv")
+            price_file = os.path.join(data_dir, "價量調查品項108-112.csv")
+
+            with ThreadPoolExecutor(max_workers=2) as ex:
+                # 0️⃣ 價量調查檔最大、且與關鍵字無關 → IndexSQL 搜尋的同時先在背景讀檔
+                f_format = ex.submit(
+                    HistoryDataSearch.read_csv_cols, format_file, HistoryDataSearch.FORMAT_COLS
+                )
+                f_price = ex.submit(
+                    HistoryDataSearch.read_csv_cols, price_file, HistoryDataSearch.PRICE_COLS
+                )
+
+                # 1️⃣ 執行 IndexSQL 搜尋
+                #    （不指定 db_file → 使用快取的記憶體資料庫，重複搜尋免重建）
+                csv_indexcode = os.path.join(data_dir, "IndexCode.csv")
+                df_find = IndexSQL.search_products(
+                    self.keyword,
+                    csv_file=csv_indexcode,
+                    verbose=False,          # UI 不需要終端輸出
+                )
+                if df_find is None:
+                    # 不需要預讀結果：取消尚未開始的讀檔
+                    ex.shutdown(wait=False, cancel_futures=True)
+                else:
+                    df_format = f_format.result()
+                    df_price = f_price.result()
+
+            # 離開 with 區塊後背景讀檔已全部結束，finished 才代表 worker 真的完成
+            if df_find is None:
+                self.finished.emit(
+                    pd.DataFrame(), f"找不到符合關鍵字「{self.keyword}」的產品", ""
+                )
+                return
+
+            # 2️⃣ 執行 HistoryDataSearch（搜尋結果直接以 DataFrame 傳入，不再讀回 CSV）
             df, msg = HistoryDataSearch.HistoryDataSearch(
                 base_dir=self.base_dir,
                 data_dir=data_dir,
-                format_file=os.path.join(data_dir, "format_clean.csv"),
-                index_file=os.path.join(data_dir, "IndexSQL_find.csv"),
-                price_file=os.path.join(data_dir, "價量調查品項108-112.csv"),
+                format_file=format_file,
+                price_file=price_file,
+                df_format=df_format,
+                df_index=df_find,
+                df_price=df_price,
             )
 
             if df is None:
@@ -200,8 +280,12 @@ class MainWindow(QMainWindow):
             self.status.setText(status_msg or "沒有資料")
             return
 
-        model = PandasModel(df)
-        self.table.setModel(model)
+        # 已有模型就直接換資料，不必每次重建
+        model = self.table.model()
+        if isinstance(model, PandasModel):
+            model.setDataFrame(df)
+        else:
+            self.table.setModel(PandasModel(df))
         self.status.setText(status_msg or "完成！")
 
 ###############################################################################
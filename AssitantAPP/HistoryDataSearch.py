@@ -9,54 +9,124 @@ By Tseng-Tasi
    • format_clean.csv           → 合法「核價類別」清單
    • IndexSQL_find.csv          → 特材代碼前五碼 ↔ 功能類別（此版僅用來先接資料）
    • 價量調查品項108-112.csv    → 歷史價量調查資料（欲標記之主體）
+   • 以 pyarrow 引擎只讀入需要的欄位（read_csv_cols），三檔以執行緒同時讀取
+   • 呼叫端也可直接傳入 DataFrame（df_format / df_index / df_price）略過讀檔
 
 2. 對三張表需要比對的欄位執行「字串標準化」：
    • 去前後空白、合併多重空白、全形→半形、轉小寫
    • 產生 *_clean 欄位，不破壞原始內容
+   • 以 clean_col() 只對不重複值做標準化再對應回整欄（規則同 clean_str()）
 
-3. 先以「特材代碼前五碼」把 價量調查資料 × IndexSQL_find 進行 inner merge
+3. 先以「特材代碼前五碼」把 價量調查資料 × IndexSQL_find 進行 inner join
+   （IndexSQL_find 以功能類別為 index，validate="m:1"）
 
-4. 再以「核價類別」(clean) 與 format_clean 做 left merge，開啟 indicator
-   -> 自動產生 _merge 欄，可得值 {both, left_only}
+4. 將 format_clean 的「核價類別」(clean) 收成合法集合
 
-5. 點數變更記錄 = 1  ⇔ _merge == 'both'
+5. 點數變更記錄 = 1  ⇔ 核價類別名稱 (clean) 在合法集合中（isin_mask，pyarrow is_in）
 
-6. 移除暫用欄位、重新排欄位順序、輸出 > HistoryData.csv
+6. 移除暫用欄位、重新排欄位順序、以 pyarrow.csv 輸出 > HistoryData.csv
 ------------------------------------------------------------
 ⚠️ 變更提醒
 ------------------------------------------------------------
 ● 若確實需要「核價類別也必須存在於 IndexSQL_find['名稱']」，
-  請把 STEP-B-2 下方的 `df_format_valid` 改成雙重交集條件，
+  請把程式中「6. 合法核價類別集合」的 `valid_set` 改成雙重交集條件，
   註解中已示範替換方法。
 
-● 如需保留大小寫敏感，可把 clean_str() 的 `.lower()` 那行註解掉。
+● 如需保留大小寫敏感，可把 clean_str()（含 ASCII 快速路徑）與 clean_col()
+  的 `.lower()` 拿掉。
 ------------------------------------------------------------
 """
 import os
-import re
 import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, Optional
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 
 
 # ---------- 共用：字串標準化 ---------------------------------------
 def clean_str(s: str) -> str:
     """
     將字串轉成統一比對格式：
-      1. NFKC 正規化 → 全形→半形、兼容字元收斂
-      2. strip()      → 去前後空白
-      3. \s+ → ' '    → 多重空白壓成單一半形空白
-      4. lower()      → 統一小寫（若需保留大小寫，移除此行）
+      1. NFKC 正規化      → 全形→半形、兼容字元收斂
+      2. split() + join() → 去前後空白並把多重空白壓成單一半形空白（一次掃描）
+      3. lower()          → 統一小寫（若需保留大小寫，移除此行）
     NaN → '' 以避免後續 .lower() 出錯
+    純 ASCII 字串 NFKC 必為原樣，直接略過正規化；
+    非 ASCII 則先以 is_normalized() 快速檢查，已正規化者同樣略過。
+    str.split() 與 regex 的 \s 採用相同的 Unicode 空白定義，結果與
+    strip() + re.sub(r"\s+", " ") 一致，但省去 regex 與中間字串。
     """
     if pd.isna(s):
         return ""
-    s = unicodedata.normalize("NFKC", str(s))
-    s = s.strip()
-    s = re.sub(r"\s+", " ", s)
+    s = str(s)
+    if not s.isascii() and not unicodedata.is_normalized("NFKC", s):
+        s = unicodedata.normalize("NFKC", s)
+    s = " ".join(s.split())
     s = s.lower()
     return s
+
+
+def clean_col(s: pd.Series) -> pd.Series:
+    """
+    clean_str() 的整欄版本：規則完全相同。
+    核價類別等欄位重複值極多，故只對「不重複值」呼叫 clean_str()，
+    再以字典對應回整欄（N 次呼叫 → K 次，K ≪ N）。
+    """
+    mapping = {v: clean_str(v) for v in s.dropna().unique()}
+    # 空欄時 map() 會得到 float64，明確轉回字串型別以利後續比對
+    return s.map(mapping).fillna("").astype(str)
+# ------------------------------------------------------------------
+
+
+# ---------- 共用：讀檔（只讀需要的欄位） ---------------------------
+FORMAT_COLS = ["核價類別"]
+INDEX_COLS  = ["名稱", "功能類別(前5碼)"]
+PRICE_COLS  = [
+    "年份", "特材代碼", "特材代碼前五碼", "核價類別名稱",
+    "中英文品名", "產品型號/規格", "單位", "支付點數",
+    "申請者簡稱", "許可證字號", "中文品名", "英文品名"
+]
+
+
+def read_csv_cols(path: str, columns: list) -> pd.DataFrame:
+    """
+    以 pyarrow 引擎（多執行緒 C++ 解析）只讀入 columns 指定的欄位。
+    先讀表頭過濾掉檔案中不存在的欄位，缺欄交由後續「欄位檢查」回報，
+    與原本「允許有欄位缺失」的行為一致。
+    """
+    header = pd.read_csv(path, encoding="utf-8", nrows=0).columns
+    return pd.read_csv(
+        path,
+        encoding="utf-8",
+        engine="pyarrow",
+        usecols=[c for c in columns if c in header],
+        dtype_backend="pyarrow"
+    )
+
+
+def isin_mask(s: pd.Series, values) -> np.ndarray:
+    """
+    Series.isin() 的 pyarrow 版本：以 pyarrow.compute.is_in 做雜湊比對，
+    Arrow 字串欄不必逐一轉成 Python 物件。回傳 bool ndarray（NA 視為不符合）。
+    兩邊一律轉成 pa.string() 再比對，避免欄位型別（例如空欄）不是字串時轉型失敗。
+    """
+    arr = pa.array(s, from_pandas=True).cast(pa.string())
+    value_set = pa.array(list(values), from_pandas=True).cast(pa.string())
+    mask = pc.is_in(arr, value_set=value_set)
+    return pc.fill_null(mask, False).to_numpy(zero_copy_only=False)
+
+
+def select_cols(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """
+    對已在記憶體中的 DataFrame 做與 read_csv_cols 相同的欄位篩選，
+    並複製一份，避免後續新增 *_clean 欄位時改到呼叫端的資料。
+    """
+    return df[[c for c in columns if c in df.columns]].copy()
 # ------------------------------------------------------------------
 
 
@@ -66,7 +136,10 @@ def HistoryDataSearch(
     format_file: Optional[str] = None,
     index_file: Optional[str] = None,
     price_file: Optional[str] = None,
-    output_file: Optional[str] = None
+    output_file: Optional[str] = None,
+    df_format: Optional[pd.DataFrame] = None,
+    df_index: Optional[pd.DataFrame] = None,
+    df_price: Optional[pd.DataFrame] = None
 ) -> Tuple[Optional[pd.DataFrame], str]:
     """
     處理歷史資料搜尋，比對核價類別和功能類別，產生點數變更記錄。
@@ -78,6 +151,9 @@ def HistoryDataSearch(
         index_file (Optional[str]): IndexSQL_find.csv 的完整路徑
         price_file (Optional[str]): 價量調查品項108-112.csv 的完整路徑
         output_file (Optional[str]): 輸出檔案 HistoryData.csv 的完整路徑
+        df_format / df_index / df_price (Optional[DataFrame]):
+            已在記憶體中的對應資料（例如 IndexSQL.search_products() 的回傳值，
+            或呼叫端預先讀好的檔案）；有給就直接沿用，不再讀對應的 CSV
     -------        
     Returns:
         依規則產生「點數變更記錄」並輸出 HistoryData.csv
@@ -95,9 +171,15 @@ def HistoryDataSearch(
 
     try:
         # ---------- 2. 讀檔 --------------------------------------
-        df_format = pd.read_csv(format_file, encoding="utf-8")
-        df_index  = pd.read_csv(index_file,  encoding="utf-8")
-        df_price  = pd.read_csv(price_file,  encoding="utf-8")
+        # 呼叫端已傳入的資料只取需要的欄位；其餘檔案互不相依，
+        # 且解析時會釋放 GIL → 以執行緒同時讀取
+        with ThreadPoolExecutor(max_workers=3) as ex:
+            f_format = ex.submit(read_csv_cols, format_file, FORMAT_COLS) if df_format is None else None
+            f_index  = ex.submit(read_csv_cols, index_file,  INDEX_COLS)  if df_index  is None else None
+            f_price  = ex.submit(read_csv_cols, price_file,  PRICE_COLS)  if df_price  is None else None
+            df_format = f_format.result() if f_format else select_cols(df_format, FORMAT_COLS)
+            df_index  = f_index.result()  if f_index  else select_cols(df_index,  INDEX_COLS)
+            df_price  = f_price.result()  if f_price  else select_cols(df_price,  PRICE_COLS)
 
         # ---------- 3. 欄位檢查 ----------------------------------
         required_cols = {
@@ -105,54 +187,51 @@ def HistoryDataSearch(
             "df_index":  ["名稱", "功能類別(前5碼)"],
             "df_price":  ["特材代碼前五碼", "核價類別名稱"]
         }
+        frames = {"df_format": df_format, "df_index": df_index, "df_price": df_price}
         for df_name, cols in required_cols.items():
-            missing = [c for c in cols if c not in locals()[df_name].columns]
+            missing = [c for c in cols if c not in frames[df_name].columns]
             if missing:
                 raise ValueError(f"{df_name} 缺少欄位: {missing}")
 
         # ---------- 4. 建立 *_clean 欄位 -------------------------
-        df_format["核價類別_clean"]     = df_format["核價類別"].apply(clean_str)
-        df_index["名稱_clean"]          = df_index["名稱"].apply(clean_str)
-        df_price["核價類別名稱_clean"] = df_price["核價類別名稱"].apply(clean_str)
+        df_format["核價類別_clean"]     = clean_col(df_format["核價類別"])
+        df_index["名稱_clean"]          = clean_col(df_index["名稱"])
+        df_price["核價類別名稱_clean"] = clean_col(df_price["核價類別名稱"])
 
         # ---------- 5. 先以「特材代碼前五碼」關聯價量調查 & IndexSQL_find
-        result = pd.merge(
-            df_price,
-            df_index[["功能類別(前5碼)", "名稱_clean"]],
-            left_on="特材代碼前五碼",
-            right_on="功能類別(前5碼)",
-            how="inner"
+        # IndexSQL_find 以功能類別為鍵（同碼重複列去除，避免價量資料被重複放大），
+        # 設為 index 後用 join；validate="m:1" 確保右表鍵值唯一
+        df_index_keyed = (
+            df_index.drop_duplicates("功能類別(前5碼)")
+                    .set_index("功能類別(前5碼)")[["名稱_clean"]]
+        )
+        result = df_price.join(
+            df_index_keyed,
+            on="特材代碼前五碼",
+            how="inner",
+            validate="m:1"
         )
 
-        # ---------- 6. 只取 format_clean 中「同時存在於 IndexSQL_find」的核價類別
+        # ---------- 6. 合法核價類別集合（format_clean）
         """
-        valid_categories = (
+        # 若需「同時存在於 IndexSQL_find」的雙重條件，改用下列集合：
+        valid_set = set(
             df_format.loc[
                 df_format["核價類別_clean"].isin(df_index["名稱_clean"]),
                 "核價類別_clean"
-            ].drop_duplicates()
+            ]
         )
-        df_format_valid = pd.DataFrame({"核價類別_clean": valid_categories})
         #---------- 如果輸出是 0 或只有零星幾個，就確定是「雙重條件」把資料全濾掉。
-        print("step-check | valid_categories =", len(valid_categories))
-        print(valid_categories[:20])        # 看看前 20 個長甚麼樣
+        print("step-check | valid_set =", len(valid_set))
+        print(list(valid_set)[:20])        # 看看前 20 個長甚麼樣
         """
-        df_format_valid = df_format[['核價類別_clean']].drop_duplicates()
-
-        # ---------- 7. 再用核價類別 (clean) 做比對，產生 _merge
-        result = result.merge(
-            df_format_valid,
-            left_on="核價類別名稱_clean",
-            right_on="核價類別_clean",
-            how="left",
-            indicator=True
-        )
+        valid_set = set(df_format["核價類別_clean"])
 
-        # ---------- 8. 設定點數變更記錄 -------------------------
-        result["點數變更記錄"] = (result["_merge"] == "both").astype(int)
+        # ---------- 7. 設定點數變更記錄：核價類別 (clean) 是否在合法集合中
+        result["點數變更記錄"] = isin_mask(result["核價類別名稱_clean"], valid_set).astype("int8")
 
-        # ---------- 9. 整理欄位順序 & 移除暫用欄 ----------------
-        drop_cols = ["名稱_clean", "核價類別_clean", "_merge"]
+        # ---------- 8. 整理欄位順序 & 移除暫用欄 ----------------
+        drop_cols = ["名稱_clean", "核價類別名稱_clean"]
         result = result.drop(columns=[c for c in drop_cols if c in result.columns])
 
         output_columns = [
@@ -164,8 +243,9 @@ def HistoryDataSearch(
         # 允許有欄位缺失（例如年份），僅保留存在的欄
         result = result[[c for c in output_columns if c in result.columns]]
 
-        # ---------- 10. 輸出 ------------------------------------
-        result.to_csv(output_file, encoding="utf-8", index=False)
+        # ---------- 9. 輸出 -------------------------------------
+        # 以 pyarrow 的 C++ CSV writer 輸出（UTF-8），比 DataFrame.to_csv 逐列格式化快
+        pacsv.write_csv(pa.Table.from_pandas(result, preserve_index=False), output_file)
         msg = (
             f"處理完成，共 {len(result)} 筆資料；"
             f"點數變更記錄=1：{result['點數變更記錄'].sum()} 筆\n"
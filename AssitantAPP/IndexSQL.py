@@ -4,31 +4,54 @@ last update: 2025-05-17
 By Tseng-Tasi
 ------------------------------------------------------------
 機制說明：
-1. 本程式先將 IndexCode.csv 的產品資料匯入 SQLite，建立資料表與索引。
-2. 使用者輸入關鍵字後，先以 SQL LIKE 查找直接匹配，若無則透過 fuzzywuzzy 進行
+1. 本程式先將 IndexCode.csv 的產品資料匯入 SQLite，建立資料表與索引；
+   若 CSV 自上次匯入後未修改（以檔案修改時間判斷），則直接沿用既有資料庫。
+2. 使用者輸入關鍵字後，先以 FTS5 全文檢索（trigram；關鍵字不足 3 字時改用 SQL LIKE）
+   查找直接匹配，若無則透過 rapidfuzz 進行
    文字相似度比對，找出最接近的產品名稱。
 3. 取得參考產品的功能類別(前5碼)，再查詢相同功能類別的所有產品，並依「大小類」
-   分組列印與匯出至 CSV。
-4. 流程結束後釋放資料庫連線。
+   分組列印（verbose=False 時略過）與匯出至 CSV，並回傳結果 DataFrame。
+4. 未指定 db_file 時改用記憶體資料庫（:memory:），連線由 get_conn() 快取，
+   同一份 CSV 的多次搜尋共用同一個連線；指定 db_file 時則於流程結束後釋放連線。
 """
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import sqlite3
-from fuzzywuzzy import process, fuzz
+import codecs
+from rapidfuzz import process, fuzz, utils
+from functools import lru_cache
 import os
+import sys
 
 def load_data_to_db(csv_file, db_file):
     """
     將 CSV 資料匯入 SQLite 資料庫，若資料庫不存在則建立一個新資料庫。
+    若資料庫檔案比 CSV 新且已有 products 表格，代表資料未變更，直接沿用不重建。
     參數:
         csv_file: CSV 檔案路徑
         db_file: 資料庫檔案名稱
     回傳:
         conn: SQLite 資料庫連線物件
     """
+    # CSV 未變更時直接沿用既有資料庫，省去重新解析 CSV 與重建表格
+    if os.path.exists(db_file) and os.path.getmtime(db_file) >= os.path.getmtime(csv_file):
+        conn = sqlite3.connect(db_file, check_same_thread=False)
+        table = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='products'"
+        ).fetchone()
+        if table:
+            return conn
+        conn.close()
+
     # 讀取 CSV 檔案
     df = pd.read_csv(csv_file, encoding="utf-8")
     # 連線至 SQLite 資料庫，若無則建立一個新資料庫
-    conn = sqlite3.connect(db_file)
+    # （UI 每次搜尋在不同 QThread 執行且不會同時進行，故允許跨執行緒共用連線）
+    conn = sqlite3.connect(db_file, check_same_thread=False)
+    # 資料表每次都由 CSV 重建，可放寬同步與日誌設定以加快寫入
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA journal_mode=MEMORY")
     
     # 建立 products 表格，欄位名稱需與 CSV 內的欄位一致
     # 注意因為欄位名稱中有括號，因此使用雙引號括起來
@@ -45,8 +68,21 @@ def load_data_to_db(csv_file, db_file):
     # 為避免重複資料，先清空表格
     conn.execute("DELETE FROM products")
     
-    # 將 DataFrame 寫入資料庫
-    df.to_sql("products", conn, if_exists="append", index=False)
+    # 將 DataFrame 以 executemany 一次寫入（與 DELETE 同一個交易），NaN 轉為 NULL
+    df = df[["功能類別(前5碼)", "名稱", "大小類", "類別"]]
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    conn.executemany("INSERT INTO products VALUES (?, ?, ?, ?)", rows)
+    
+    # 建立全文檢索表（trigram 斷詞可做子字串查詢），內容取自 products 並隨之重建；
+    # 若 SQLite 不支援 FTS5 / trigram 則略過，查詢時自動改用 LIKE
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts
+            USING fts5(名稱, 大小類, 類別, content='products', tokenize='trigram')
+        ''')
+        conn.execute("INSERT INTO products_fts(products_fts) VALUES('rebuild')")
+    except sqlite3.OperationalError:
+        pass
     conn.commit()
     return conn
 
@@ -59,18 +95,53 @@ def create_index(conn):
     conn.execute('CREATE INDEX IF NOT EXISTS idx_function_code ON products("功能類別(前5碼)")')
     conn.commit()
 
+def get_conn(csv_file):
+    """
+    取得 CSV 對應的記憶體資料庫連線（已建立索引）。
+    以 CSV 路徑與修改時間為快取鍵，CSV 未變更時重複搜尋共用同一個連線。
+    參數:
+        csv_file: CSV 檔案路徑
+    回傳:
+        conn: SQLite 資料庫連線物件（共用，呼叫端請勿關閉）
+    """
+    return _get_conn(csv_file, os.path.getmtime(csv_file))
+
+@lru_cache(maxsize=1)
+def _get_conn(csv_file, mtime):
+    conn = load_data_to_db(csv_file, ":memory:")
+    create_index(conn)
+    return conn
+
+def has_fts(conn):
+    """檢查資料庫是否已建立 products_fts 全文檢索表"""
+    table = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='products_fts'"
+    ).fetchone()
+    return table is not None
+
 def fuzzy_search_product(conn, keyword, threshold=40):
     """利用模糊匹配在資料庫中搜尋相關產品"""
     # 從資料庫中取出所有產品相關資訊
-    query = """
-    SELECT 名稱, "功能類別(前5碼)", 大小類, 類別 
-    FROM products 
-    WHERE 名稱 LIKE ? 
-    OR 大小類 LIKE ? 
-    OR 類別 LIKE ?
-    """
-    search_pattern = f"%{keyword}%"
-    cursor = conn.execute(query, (search_pattern, search_pattern, search_pattern))
+    # trigram 全文檢索至少需 3 個字元；較短的關鍵字或無全文檢索表時改用 LIKE 全表掃描
+    if len(keyword) >= 3 and has_fts(conn):
+        query = """
+        SELECT 名稱, "功能類別(前5碼)", 大小類, 類別 
+        FROM products 
+        WHERE rowid IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)
+        """
+        # 以雙引號包成片語查詢 → 等同子字串比對（三個欄位任一符合即可）
+        params = ('"' + keyword.replace('"', '""') + '"',)
+    else:
+        query = """
+        SELECT 名稱, "功能類別(前5碼)", 大小類, 類別 
+        FROM products 
+        WHERE 名稱 LIKE ? 
+        OR 大小類 LIKE ? 
+        OR 類別 LIKE ?
+        """
+        search_pattern = f"%{keyword}%"
+        params = (search_pattern, search_pattern, search_pattern)
+    cursor = conn.execute(query, params)
     direct_matches = cursor.fetchall()
     
     if direct_matches:
@@ -80,18 +151,23 @@ def fuzzy_search_product(conn, keyword, threshold=40):
     # 如果沒有直接匹配，使用模糊匹配
     df_products = pd.read_sql("SELECT 名稱, \"功能類別(前5碼)\" FROM products", conn)
     product_names = df_products["名稱"].tolist()
+    # 名稱 → 功能類別(前5碼) 對照表（同名取第一筆，與原本 fetchone 行為一致），
+    # 比對後直接查表，不必再逐筆回資料庫查詢
+    unique_products = df_products.drop_duplicates("名稱")
+    name_to_code = dict(zip(unique_products["名稱"], unique_products["功能類別(前5碼)"]))
     
-    # 使用模糊匹配找出所有符合閾值的結果
-    matches = process.extract(keyword, product_names, scorer=fuzz.token_set_ratio, limit=30)
+    # 使用模糊匹配找出所有符合閾值的結果（score_cutoff 讓低於閾值者直接被略過）
+    # rapidfuzz 預設不做前處理；指定 default_process（轉小寫、去除非英數字元）
+    # 以維持 fuzzywuzzy full_process 的不分大小寫比對
+    matches = process.extract(keyword, product_names, scorer=fuzz.token_set_ratio,
+                              processor=utils.default_process,
+                              limit=30, score_cutoff=threshold)
     
-    matched_products = []
-    for matched_name, score in matches:
-        if score >= threshold:
-            query = 'SELECT "功能類別(前5碼)" FROM products WHERE 名稱 = ?'
-            cursor = conn.execute(query, (matched_name,))
-            ref_product = cursor.fetchone()
-            if ref_product:
-                matched_products.append((matched_name, ref_product[0]))
+    matched_products = [
+        (matched_name, name_to_code[matched_name])
+        for matched_name, score, _ in matches
+        if matched_name in name_to_code
+    ]
     
     if matched_products:
         return matched_products
@@ -117,7 +193,7 @@ def query_products_by_function(conn, ref_code):
     df_results = pd.DataFrame(results, columns=["功能類別(前5碼)", "名稱", "大小類", "類別"])
     return df_results
 
-def search_products(keyword, db_file="products.db", csv_file="IndexCode.csv"):
+def search_products(keyword, db_file=None, csv_file="IndexCode.csv", verbose=True):
     """
     主函式：
       1. 將 CSV 資料匯入資料庫並建立索引。
@@ -125,28 +201,34 @@ def search_products(keyword, db_file="products.db", csv_file="IndexCode.csv"):
       3. 查詢所有擁有相同功能類別(前5碼)的產品，並依照大小類分組輸出。
     參數:
         keyword: 使用者輸入的關鍵字或產品名稱
-        db_file: 資料庫檔案名稱（預設 "products.db"）
+        db_file: 資料庫檔案名稱（預設 None → 使用 get_conn() 快取的記憶體資料庫）
         csv_file: CSV 檔案路徑（預設 "IndexCode.csv"）
+        verbose: 是否將分組結果輸出到終端（UI 不需要，可設為 False 略過）
+    回傳:
+        pd.DataFrame: 所有相關產品（同時匯出為 IndexSQL_find.csv）；找不到時回傳 None
     """
     # 匯入資料到資料庫
-    conn = load_data_to_db(csv_file, db_file)
-    create_index(conn)
+    if db_file is None:
+        conn = get_conn(csv_file)
+    else:
+        conn = load_data_to_db(csv_file, db_file)
+        create_index(conn)
     
     # 使用模糊匹配取得參考產品的功能類別(前5碼)
     matched_products = fuzzy_search_product(conn, keyword)
     if not matched_products:
-        conn.close()
-        return
+        if db_file is not None:
+            conn.close()
+        return None
     
-    print(f"\n找到 {len(matched_products)} 個相關產品:")
+    # 終端輸出先累積成一份文字，最後一次寫出
+    lines = [f"\n找到 {len(matched_products)} 個相關產品:"]
     
-    # 創建一個空的 DataFrame 來存儲所有結果
-    all_results_df = pd.DataFrame()
+    # 先收集各產品的結果，迴圈結束後再一次合併（避免在迴圈中反覆 concat）
+    result_parts = []
     
     # 處理每個匹配的產品
     for matched_name, ref_code in matched_products:
-        print(f"\n參考產品: {matched_name}, 功能類別: {ref_code}")
-        
         # 根據功能類別(前5碼)查詢所有相關產品
         df_results = query_products_by_function(conn, ref_code)
         
@@ -154,23 +236,33 @@ def search_products(keyword, db_file="products.db", csv_file="IndexCode.csv"):
         df_results['搜尋關鍵字'] = keyword
         df_results['參考產品'] = matched_name
         
-        # 將結果添加到總表中
-        all_results_df = pd.concat([all_results_df, df_results])
+        # 將結果加入待合併清單
+        result_parts.append(df_results)
         
-        # 根據大小類進行分組並輸出到終端
-        grouped = df_results.groupby("大小類")
-        for group_name, group_data in grouped:
-            print(f"\n大小類: {group_name}")
-            print(group_data[["名稱", "功能類別(前5碼)", "類別"]])
-            print("-" * 30)
-    
-    # 儲存所有結果到 CSV 檔案
+        # 根據大小類進行分組，整理成終端輸出文字
+        if verbose:
+            lines.append(f"\n參考產品: {matched_name}, 功能類別: {ref_code}")
+            for group_name, group_data in df_results.groupby("大小類"):
+                lines.append(f"\n大小類: {group_name}")
+                lines.append(str(group_data[["名稱", "功能類別(前5碼)", "類別"]]))
+                lines.append("-" * 30)
+    
+    # 合併所有結果並儲存到 CSV 檔案
+    all_results_df = pd.concat(result_parts, ignore_index=True)
     output_dir = os.path.dirname(csv_file)
     output_file = os.path.join(output_dir, "IndexSQL_find.csv")
-    all_results_df.to_csv(output_file, index=False, encoding='utf-8-sig')
-    print(f"\n搜尋結果已保存到：{output_file}")
+    # 以 pyarrow 的 C++ CSV writer 輸出；先寫入 BOM，維持 utf-8-sig 讓 Excel 正確辨識編碼
+    with open(output_file, "wb") as f:
+        f.write(codecs.BOM_UTF8)
+        pacsv.write_csv(pa.Table.from_pandas(all_results_df, preserve_index=False), f)
+    lines.append(f"\n搜尋結果已保存到：{output_file}")
+    if verbose:
+        sys.stdout.write("\n".join(lines) + "\n")
     
-    conn.close()
+    # 共用的記憶體資料庫連線保留給下次搜尋
+    if db_file is not None:
+        conn.close()
+    return all_results_df
 
 # 主程式執行
 if __name__ == "__main__":